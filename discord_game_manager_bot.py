@@ -11,12 +11,16 @@
 
 # Import built in modules
 import os
+import atexit
+import asyncio
 import sys
 import json
 import logging
 import logging.handlers
+import queue
 import random
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 # Import third party modules
 import discord
@@ -25,9 +29,30 @@ from dotenv import load_dotenv
 from discord_game_manager.modules.ServerMonitor import ServerMonitor
 from discord_game_manager.modules.ServerMonitor import ServerMonitorError
 
-load_dotenv("./config/.discord-env")
-load_dotenv("./config/.server-env")
+# Only read the .env files when their values haven't already been injected
+# into the environment, e.g. by the container
+if not os.getenv("discord_token"):
+    load_dotenv("./config/.discord-env", override=False)
+if not os.getenv("base_url"):
+    load_dotenv("./config/.server-env", override=False)
+
+# ServerMonitor makes blocking XML-RPC calls, so they are run on this executor
+# to keep the event loop free. A single worker is used because the calls share
+# one ServerProxy connection, which is not safe to use from several threads.
+_sm_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ServerMonitor")
+
+monitor = ServerMonitor(
+    base_url=os.getenv("base_url"),
+    api_endpoint=os.getenv("api_endpoint"),
+    api_user=os.getenv("api_user"),
+    api_pwd=os.getenv("api_pwd"),
+)
 
+# Static messages sent by the novelty commands
+_LOL_MSG: str = ("lolo" * 50) + "l"
+_ORANGES_MSG: str = """
+    WHY are all of your Naval Oranges (non organic) from South Africa?! The organic ones are USA...hmmmm... so sick of my food coming from other countries...BUY USA!
+    """
 
 description = """An example bot to showcase the discord.ext.commands extension
 module.
@@ -50,21 +75,18 @@ bot = commands.Bot(
 async def on_ready():
     print(f"Logged in as {bot.user} (ID: {bot.user.id})")
     print("------")
+    _backfill_member_perms()
 
 
 @bot.command("lol")
 async def lol(ctx):
-    lol_msg: str = ("lolo" * 50) + "l"
-    await ctx.send(lol_msg, tts=True)
+    await ctx.send(_LOL_MSG, tts=True)
 
 
 @bot.command("oranges")
 async def oranges(ctx):
-    oranges_str: str = """
-    WHY are all of your Naval Oranges (non organic) from South Africa?! The organic ones are USA...hmmmm... so sick of my food coming from other countries...BUY USA!
-    """
     await ctx.message.add_reaction("😡")
-    await ctx.send(oranges_str, tts=True)
+    await ctx.send(_ORANGES_MSG, tts=True)
 
 
 ###################################
@@ -74,50 +96,130 @@ async def oranges(ctx):
 #### DEFINE RBAC ROLES
 
 
-def has_a_gamemanager_role():
-    def predicate(ctx):
-        allowed_roles = [
-            "Bot Manager - Status Permission",
-            "Bot Manager - Restart Permission",
-        ]
-        if not any(role.name in allowed_roles for role in ctx.author.roles):
-            raise commands.MissingAnyRole(allowed_roles)
-        print(
-            f"{ctx.author} has role: {list(role.name in allowed_roles for role in ctx.author.roles)}"
-        )
-        return any(role.name in allowed_roles for role in ctx.author.roles)
+# Role names which grant access to the game manager commands
+STATUS_ROLE = "Bot Manager - Status Permission"
+RESTART_ROLE = "Bot Manager - Restart Permission"
+ALLOWED = frozenset({STATUS_ROLE, RESTART_ROLE})
 
-    return commands.check(predicate)
+# Allowed role names held by each member, keyed by (guild id, member id). This
+# is kept up to date by the member and role listeners below, so the RBAC checks
+# are a dict lookup rather than a scan of the author's roles on every command.
+_member_perms: dict[tuple[int, int], frozenset[str]] = {}
 
 
-def has_gamemanager_restart_role():
-    def predicate(ctx):
-        allowed_roles = ["Bot Manager - Restart Permission"]
-        if not any(role.name in allowed_roles for role in ctx.author.roles):
-            raise commands.MissingRole(f", ".join(allowed_roles))
-        print(
-            f"{ctx.author} has role: {list(role.name in allowed_roles for role in ctx.author.roles)}"
-        )
-        return any(role.name in allowed_roles for role in ctx.author.roles)
+def _refresh_member_perms(member: discord.Member) -> frozenset:
+    """Recomputes and stores the allowed roles held by a guild member
 
-    return commands.check(predicate)
+    Args:
+        member (discord.Member): Member whose roles should be cached
+
+    Returns:
+        frozenset: Names of the allowed roles the member holds
+    """
+    perms = frozenset(role.name for role in member.roles) & ALLOWED
+    _member_perms[(member.guild.id, member.id)] = perms
+    return perms
 
 
-def has_gamemanager_status_role():
+def _refresh_guild_perms(guild: discord.Guild) -> None:
+    """Recomputes and stores the allowed roles held by every member of a guild
+
+    Args:
+        guild (discord.Guild): Guild whose members should be cached
+    """
+    for member in guild.members:
+        _refresh_member_perms(member)
+    logger.debug("Cached roles for %s members of %s", len(guild.members), guild)
+
+
+def _backfill_member_perms() -> None:
+    """Populates _member_perms for every member of every guild the bot is in"""
+    for guild in bot.guilds:
+        _refresh_guild_perms(guild)
+
+
+@bot.event
+async def on_member_join(member):
+    _refresh_member_perms(member)
+
+
+@bot.event
+async def on_member_update(before, after):
+    if before.roles != after.roles:
+        _refresh_member_perms(after)
+
+
+@bot.event
+async def on_member_remove(member):
+    _member_perms.pop((member.guild.id, member.id), None)
+
+
+# Renaming or deleting a role can change which members hold an allowed role
+# name without firing on_member_update, so the guild is recached
+@bot.event
+async def on_guild_role_update(before, after):
+    if before.name != after.name and (before.name in ALLOWED or after.name in ALLOWED):
+        _refresh_guild_perms(after.guild)
+
+
+@bot.event
+async def on_guild_role_delete(role):
+    if role.name in ALLOWED:
+        _refresh_guild_perms(role.guild)
+
+
+def _check(ctx, required: frozenset) -> bool:
+    """Returns True if the command author holds at least one of the required roles.
+
+    Args:
+        ctx (commands.Context): Context of the invoked command
+        required (frozenset): Role names, any one of which satisfies the check
+
+    Returns:
+        bool: True if the author has one of the required roles
+    """
+    # Roles only exist within a guild, so commands sent by DM are denied
+    if ctx.guild is None:
+        logger.debug("%s roles match: False (direct message)", ctx.author)
+        return False
+    perms = _member_perms.get((ctx.guild.id, ctx.author.id))
+    # Fall back to the author's roles if the member hasn't been cached yet
+    if perms is None:
+        perms = _refresh_member_perms(ctx.author)
+    ok = not perms.isdisjoint(required)
+    logger.debug("%s roles match: %s", ctx.author, ok)
+    return ok
+
+
+def require_roles(*roles: str):
+    """Command check which passes if the author holds any of the provided roles
+
+    Args:
+        *roles (str): Role names, any one of which grants access to the command
+
+    Raises:
+        commands.MissingRole: Raised by the check if a single role was required and the author lacks it
+        commands.MissingAnyRole: Raised by the check if several roles were allowed and the author has none
+
+    Returns:
+        Callable: A commands.check decorator
+    """
+    allowed = frozenset(roles)
+
     def predicate(ctx):
-        allowed_roles = ["Bot Manager - Status Permission"]
-        if not any(role.name in allowed_roles for role in ctx.author.roles):
-            raise commands.MissingRole(f", ".join(allowed_roles))
-        print(
-            f"{ctx.author} has role: {list(role.name in allowed_roles for role in ctx.author.roles)}"
-        )
-        return any(role.name in allowed_roles for role in ctx.author.roles)
+        if not _check(ctx, allowed):
+            # A new error is raised each time, re-raising one instance would
+            # grow its traceback and keep every denied command's frames alive
+            if len(roles) == 1:
+                raise commands.MissingRole(roles[0])
+            raise commands.MissingAnyRole(list(roles))
+        return True
 
     return commands.check(predicate)
 
 
 @bot.group()
-@has_a_gamemanager_role()
+@require_roles(STATUS_ROLE, RESTART_ROLE)
 async def gamemanager(ctx):
     if ctx.subcommand_passed is None:
         await help(ctx)
@@ -139,13 +241,19 @@ async def gamemanager_error(ctx, error):
 ##############################
 # GAME MANAGER RESTART PROCESS
 @gamemanager.command("restart")
-@has_gamemanager_restart_role()
+@require_roles(RESTART_ROLE)
 async def restart(ctx, process_name: str = None):
     if process_name is None:
         raise commands.BadArgument(
             f"You must provide the name of the process to restart, such as ```!gamemanager restart valheim-server```"
         )
     await ctx.send(f"Process {process_name} will be restarted.")
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(_sm_executor, monitor.restart_process, process_name)
+    except ServerMonitorError as sm_err:
+        await ctx.send(f"Unable to restart process {process_name}: {sm_err}")
+        return
     await ctx.send(f"The process {process_name} has been restarted successfully.")
 
 
@@ -163,9 +271,18 @@ async def restart_error(ctx, error):
 ##############################
 # GAME MANAGER VIEW ALL PROCESSES
 @gamemanager.command("status")
-@has_gamemanager_status_role()
+@require_roles(STATUS_ROLE)
 async def status(ctx):
-    await ctx.send(f"status of processes")
+    loop = asyncio.get_running_loop()
+    try:
+        process_states = await loop.run_in_executor(
+            _sm_executor, monitor.get_process_states
+        )
+    except ServerMonitorError as sm_err:
+        await ctx.send(f"Unable to get the status of processes: {sm_err}")
+        return
+    status_lines = "\n".join(f"{name}: {state}" for name, state in process_states)
+    await ctx.send(f"```\n{status_lines}\n```")
 
 
 @status.error
@@ -179,17 +296,7 @@ async def status_error(ctx, error):
 
 ##############################
 # GAME MANAGER HELP
-@gamemanager.command("help")
-@has_a_gamemanager_role()
-async def help(ctx):
-    embed_msg = discord.Embed(color=None, title="Game Manager Help", type="rich")
-    embed_msg.set_author(name="Thomas Obarowski")
-    embed_msg.add_field(
-        name="Introduction",
-        value="The gamemanager command will help you interact with the Valheim server running within docker.",
-    )
-    await ctx.send(
-        """The game manager bot is aimed at assisting the gamers with viewing the status of the Valheim Container, and interacting with it's processes, if necessary.
+_HELP_TEXT: str = """The game manager bot is aimed at assisting the gamers with viewing the status of the Valheim Container, and interacting with it's processes, if necessary.
     Usage:
         !gamemanager view - view a list of all Valheim related processes running with the container, including the 'Valheim Server' itself.
         !gamemanager restart <process name> - Provide the bot a process name (from !gamemager view) to restart.
@@ -198,7 +305,20 @@ async def help(ctx):
         !gamemanager - You must have at least one of the following server roles: Bot Manager - Status Permission, Bot Manager - Restart Permission
         !gamemanager view - You must have the 'Bot Manager - Status Permission' server role.
         !gamemanager restart - You must have the 'Bot Manager - Restart Permission' server role."""
-    )
+
+# The help embed is static, so it is built once and reused for every request
+_HELP_EMBED = discord.Embed(color=None, title="Game Manager Help", type="rich")
+_HELP_EMBED.set_author(name="Thomas Obarowski")
+_HELP_EMBED.add_field(
+    name="Introduction",
+    value="The gamemanager command will help you interact with the Valheim server running within docker.",
+)
+
+
+@gamemanager.command("help")
+@require_roles(STATUS_ROLE, RESTART_ROLE)
+async def help(ctx):
+    await ctx.send(_HELP_TEXT, embed=_HELP_EMBED)
 
 
 @help.error
@@ -230,7 +350,20 @@ formatter = logging.Formatter(
     "[{asctime}] [{levelname:<8}] {name}: {message}", dt_fmt, style="{"
 )
 handler.setFormatter(formatter)
-logger.addHandler(handler)
-logger.addHandler(consoleHandler)
+
+# The file and console handlers run on a background listener thread, so logging
+# from the event loop only enqueues the record instead of writing to disk
+log_queue = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(log_queue))
+listener = logging.handlers.QueueListener(
+    log_queue, handler, consoleHandler, respect_handler_level=True
+)
+listener.start()
+atexit.register(listener.stop)
+# atexit runs handlers in reverse order, so on shutdown the executor finishes
+# any queued ServerMonitor calls, then the supervisor connection is closed,
+# and only then is the log listener stopped
+atexit.register(monitor.close)
+atexit.register(_sm_executor.shutdown)
 
 bot.run(os.getenv("discord_token"), log_handler=None)
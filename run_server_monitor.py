@@ -26,7 +26,10 @@ from xmlrpc.client import ServerProxy
 # Import 3rd party packages
 from dotenv import load_dotenv
 
-load_dotenv("./config/.server-env")
+# Only read the .env file when its values haven't already been injected
+# into the environment, e.g. by the container
+if not os.getenv("base_url"):
+    load_dotenv("./config/.server-env", override=False)
 
 
 def create_logger() -> logging.Logger:
@@ -68,7 +71,10 @@ if __name__ == "__main__":
             api_pwd=os.getenv("api_pwd"),
         )
 
-        print(json.dumps(ValheimServerMonitor.get_all_process_info(), indent=4))
-        print(ValheimServerMonitor.restart_process("valheim-server"))
+        try:
+            print(json.dumps(ValheimServerMonitor.get_all_process_info(), indent=4))
+            print(ValheimServerMonitor.restart_process("valheim-server"))
+        finally:
+            ValheimServerMonitor.close()
     except ServerMonitorError as sm_err:
         logger.info(sm_err)